@@ -3,17 +3,27 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import contextlib
 import logging
+import logging.handlers
 import os
+import queue
+import re
 import shutil
+import signal
 import subprocess
 import sys
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Iterable, List
+from typing import Iterable, List, Optional, Sequence
+
+try:
+    import psutil
+except ImportError:  # optional; only used to size the default job count
+    psutil = None
 
 DEFAULT_PLUG_DIRS = [
     "/Library/Audio/Plug-Ins/VST3",
@@ -21,20 +31,28 @@ DEFAULT_PLUG_DIRS = [
 ]
 
 ARCH_MISMATCH_TOKEN = "doesn't contain a version for the current architecture"
+ARCH_MISMATCH_RE = re.compile(re.escape(ARCH_MISMATCH_TOKEN), re.IGNORECASE)
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+# Universal newlines, matching the text-mode reader this replaced
+LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+LOG_BUFFER_CAPACITY = 1024
+TERMINATE_GRACE_SECONDS = 0.5
+DRAIN_GRACE_SECONDS = 0.5
 
 
 @dataclass
 class CaptureResult:
     """Result of attempting to capture a single plugin."""
     plugin: Path
-    skipped: bool = False
     success: bool = False
     timed_out: bool = False
     failed: bool = False
-    output: str = ""
+    arch_mismatch: bool = False
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
         "out_dir",
@@ -74,10 +92,44 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Re-capture even if a PNG already exists.",
     )
-    return parser.parse_args()
-
-
-def configure_logging(log_path: Path) -> logging.Logger:
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of captures to run concurrently (default: physical core count)",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def default_jobs() -> int:
+    """Return the default number of concurrent captures."""
+    # One per physical core: each vstface brings its own GUI threads, so SMT siblings oversubscribe
+    if psutil is not None:
+        physical = psutil.cpu_count(logical=False)
+        if physical:
+            return physical
+    if sys.platform == "darwin":
+        # Apple Silicon has no SMT, so halving the logical count would waste cores
+        try:
+            result = subprocess.run(
+                ["sysctl", "-n", "hw.physicalcpu"],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            return max(1, int(result.stdout))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def configure_logging(log_path: Path) -> tuple[logging.Logger, logging.handlers.QueueListener]:
+    """Configure the "scan" logger and start its queue listener."""
+    # Handler I/O runs on the listener thread, keeping it off the event loop
     log_path.parent.mkdir(parents=True, exist_ok=True)
     logger = logging.getLogger("scan")
     logger.setLevel(logging.INFO)
@@ -85,90 +137,190 @@ def configure_logging(log_path: Path) -> logging.Logger:
 
     file_handler = logging.FileHandler(log_path, mode="w")
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    # Batch file writes; warnings and errors still hit the log immediately
+    buffered_file_handler = logging.handlers.MemoryHandler(
+        LOG_BUFFER_CAPACITY, flushLevel=logging.WARNING, target=file_handler
+    )
 
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
 
-    return logger
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, buffered_file_handler, stream_handler, respect_handler_level=True
+    )
+    listener.start()
+
+    return logger, listener
+
 
+def shutdown_logging(logger: logging.Logger, listener: logging.handlers.QueueListener) -> None:
+    """Detach the queue, drain it, then flush and close every handler."""
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    listener.stop()
+    for handler in listener.handlers:
+        target = getattr(handler, "target", None)
+        handler.close()
+        if target is not None:
+            target.close()
 
-def iter_plugins(dirs: Iterable[str]) -> Iterable[Path]:
+
+def iter_plugins(dirs: Iterable[str]) -> Iterable[tuple[Path, str]]:
+    """Yield each bundle with its capture name, prefixed by any vendor subfolders."""
     for base in dirs:
         base_path = Path(base).expanduser()
         if not base_path.is_dir():
             continue
-        for plugin in sorted(base_path.glob("*.vst3")):
-            yield plugin
-
-
-def run_capture(cmd: List[str], timeout: int, logger: logging.Logger) -> tuple[int, bool, str]:
-    proc = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-        universal_newlines=True,
-    )
+        # Walk vendor subfolders too, but never descend into a bundle itself
+        for dirpath, dirnames, _ in os.walk(base_path):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+            bundles = [name for name in dirnames if name.endswith(".vst3")]
+            dirnames[:] = [name for name in dirnames if not name.endswith(".vst3")]
+            relative = os.path.relpath(dirpath, base_path)
+            prefix = "" if relative == os.curdir else relative.replace(os.sep, "-") + "-"
+            for name in bundles:
+                plugin = Path(dirpath, name)
+                yield plugin, prefix + plugin.stem
 
-    lines: List[str] = []
 
-    def reader() -> None:
-        assert proc.stdout is not None
-        for line in proc.stdout:
-            stripped = line.rstrip()
-            lines.append(stripped)
-            logger.info(stripped)
+def signal_group(pgid: int, sig: signal.Signals) -> None:
+    # ESRCH once the group is gone; macOS reports EPERM when only zombies remain
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pgid, sig)
 
-    thread = threading.Thread(target=reader, daemon=True)
-    thread.start()
-    timed_out = False
+
+class ExitNotifyingProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    """Stream protocol that resolves ``exited`` as soon as vstface itself exits."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # Process.wait() only returns once stdout closes, which a leftover helper can delay
+        self.exited: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+    def process_exited(self) -> None:
+        super().process_exited()
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+
+async def terminate_group(pgid: int, exited: asyncio.Future[None]) -> None:
+    """SIGTERM the capture's process group, then SIGKILL whatever outlives the grace period."""
+    signal_group(pgid, signal.SIGTERM)
     try:
-        returncode = proc.wait(timeout=timeout)
-    except subprocess.TimeoutExpired:
-        timed_out = True
-        proc.kill()
-        returncode = proc.wait()
-    thread.join()
-    return returncode, timed_out, "\n".join(lines)
+        await asyncio.wait({exited}, timeout=TERMINATE_GRACE_SECONDS)
+    finally:
+        # Helpers may ignore SIGTERM even after vstface itself has exited
+        signal_group(pgid, signal.SIGKILL)
+    await exited
+
+
+async def run_capture(
+    cmd: List[str], timeout: int, detect_arch_mismatch: bool, logger: logging.Logger
+) -> tuple[int, bool, bool]:
+    """Run vstface, logging its output; returns (returncode, timed_out, arch_mismatch)."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.subprocess_exec(
+        lambda: ExitNotifyingProtocol(limit=READ_CHUNK_SIZE, loop=loop),
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        # Own process group, so a timeout can take down helpers vstface spawned too
+        start_new_session=True,
+    )
+    proc = asyncio.subprocess.Process(transport, protocol, loop)
+
+    arch_mismatch = False
+    partial = bytearray()
 
+    def emit(line: bytes) -> None:
+        nonlocal arch_mismatch
+        stripped = line.decode(errors="replace").rstrip()
+        logger.info(stripped)
+        if detect_arch_mismatch and not arch_mismatch:
+            arch_mismatch = ARCH_MISMATCH_RE.search(stripped) is not None
 
-def process_plugin(
+    async def drain() -> None:
+        # Read whatever the pipe has buffered rather than awaiting once per line;
+        # this also avoids StreamReader's 64 KiB line limit on unterminated output.
+        assert proc.stdout is not None
+        after_cr = False
+        while chunk := await proc.stdout.read(READ_CHUNK_SIZE):
+            if after_cr and chunk.startswith(b"\n"):
+                # The \n of a \r\n pair split across reads; the \r already ended the line
+                chunk = chunk[1:]
+            after_cr = chunk.endswith(b"\r")
+            # Only the new chunk is searched, so a long unterminated line stays linear
+            newline = max(chunk.rfind(b"\n"), chunk.rfind(b"\r"))
+            if newline == -1:
+                partial.extend(chunk)
+                if len(partial) >= MAX_LINE_BYTES:
+                    # Log oversized lines in pieces rather than buffering without bound
+                    emit(partial)
+                    partial.clear()
+                continue
+            partial.extend(chunk[: newline + 1])
+            # The buffer ends with a line break, so the last split piece is always empty
+            *complete, _ = LINE_BREAK_RE.split(partial)
+            for line in complete:
+                emit(line)
+            partial[:] = chunk[newline + 1:]
+
+    # The timeout applies to vstface exiting; output is read alongside it
+    drain_task = asyncio.create_task(drain())
+    timed_out = False
+    try:
+        await asyncio.wait({protocol.exited}, timeout=timeout)
+        if not protocol.exited.done():
+            timed_out = True
+            await terminate_group(proc.pid, protocol.exited)
+        # Give the reader a moment to collect what vstface wrote before exiting
+        await asyncio.wait({drain_task}, timeout=DRAIN_GRACE_SECONDS)
+    finally:
+        # Either a helper still holds stdout, or we were cancelled (e.g. Ctrl-C, which
+        # the child never sees outside our process group): take the group down
+        if not drain_task.done() or not protocol.exited.done():
+            signal_group(proc.pid, signal.SIGKILL)
+            drain_task.cancel()
+        transport.close()
+    if partial:
+        emit(partial)
+    assert proc.returncode is not None
+    return proc.returncode, timed_out, arch_mismatch
+
+
+async def process_plugin(
     plugin: Path,
-    out_dir: Path,
-    vstface: Path,
+    out_path: str,
+    vstface: str,
     timeout: int,
-    force: bool,
+    detect_arch_mismatch: bool,
     logger: logging.Logger,
 ) -> CaptureResult:
     """Process a single plugin capture."""
-    out_path = out_dir / f"{plugin.stem}.png"
-
-    # Check if already captured
-    if out_path.exists() and not force:
-        logger.info("Skipping %s (already captured)", plugin)
-        return CaptureResult(plugin=plugin, skipped=True)
-
     # Run capture
     logger.info("Capturing %s -> %s", plugin, out_path)
-    cmd = [str(vstface), str(plugin), str(out_path)]
-    returncode, timed_out, output = run_capture(cmd, timeout, logger)
+    cmd = [vstface, str(plugin), out_path]
+    returncode, timed_out, arch_mismatch = await run_capture(
+        cmd, timeout, detect_arch_mismatch, logger
+    )
 
     if timed_out:
         logger.warning("TIMEOUT: %s", plugin)
-        return CaptureResult(plugin=plugin, timed_out=True, output=output)
+        return CaptureResult(plugin=plugin, timed_out=True, arch_mismatch=arch_mismatch)
     elif returncode != 0:
         logger.warning("FAILED (%d): %s", returncode, plugin)
-        return CaptureResult(plugin=plugin, failed=True, output=output)
+        return CaptureResult(plugin=plugin, failed=True, arch_mismatch=arch_mismatch)
     else:
         logger.info("Captured %s", plugin)
         return CaptureResult(plugin=plugin, success=True)
 
 
-def main() -> int:
-    args = parse_args()
+async def main_async(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
@@ -178,9 +330,15 @@ def main() -> int:
         stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         log_path = out_dir / f"vstface-{stamp}.log"
 
-    logger = configure_logging(log_path)
+    logger, listener = configure_logging(log_path)
+    try:
+        return await scan(args, out_dir, logger)
+    finally:
+        shutdown_logging(logger, listener)
+
 
-    vstface = Path(args.bin)
+async def scan(args: argparse.Namespace, out_dir: Path, logger: logging.Logger) -> int:
+    vstface = Path(args.bin).absolute()
     if not vstface.is_file():
         logger.error("Expected vstface binary at %s", vstface)
         return 1
@@ -193,38 +351,63 @@ def main() -> int:
         logger.warning("No plugins found in %s", plugin_dirs)
         return 0
 
-    # Use all available CPU cores
-    max_workers = os.cpu_count() or 4
-    logger.info("Processing %d plugins using %d workers", total, max_workers)
+    # Build argv strings once here rather than converting Paths per capture
+    vstface_str = str(vstface)
+    out_dir_str = str(out_dir)
+    captures = []
+    owners: dict[str, Path] = {}
+    for plugin, name in plugins:
+        # Same-named bundles in different roots would overwrite each other's PNG
+        if name in owners:
+            logger.warning(
+                "Skipping %s (capture name %s already used by %s)", plugin, name, owners[name]
+            )
+            continue
+        owners[name] = plugin
+        captures.append((plugin, f"{out_dir_str}/{name}.png"))
+
+    # Check for existing captures up front so skipped plugins never occupy a slot
+    if not args.force:
+        to_capture = []
+        for plugin, out_path in captures:
+            if os.path.exists(out_path):
+                logger.info("Skipping %s (already captured)", plugin)
+            else:
+                to_capture.append((plugin, out_path))
+        captures = to_capture
+    skipped = total - len(captures)
+
+    max_workers = args.jobs or default_jobs()
+    logger.info("Processing %d plugins using %d workers", len(captures), max_workers)
 
-    skipped = 0
     success = 0
     failures = 0
     timeouts = 0
 
-    # Process plugins in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        futures = {
-            executor.submit(
-                process_plugin,
+    def submit(plugin: Path, out_path: str) -> asyncio.Task[CaptureResult]:
+        return asyncio.create_task(
+            process_plugin(
                 plugin,
-                out_dir,
-                vstface,
+                out_path,
+                vstface_str,
                 args.timeout,
-                args.force,
+                args.delete_unsupported,
                 logger,
-            ): plugin
-            for plugin in plugins
-        }
+            )
+        )
+
+    # Keep at most max_workers captures in flight, topping up as each completes
+    remaining = iter(captures)
+    pending = {submit(*capture) for capture in islice(remaining, max_workers)}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for capture in islice(remaining, len(done)):
+            pending.add(submit(*capture))
 
-        # Process results as they complete
-        for future in as_completed(futures):
-            result = future.result()
+        for task in done:
+            result = task.result()
 
-            if result.skipped:
-                skipped += 1
-            elif result.success:
+            if result.success:
                 success += 1
             elif result.timed_out:
                 timeouts += 1
@@ -232,11 +415,7 @@ def main() -> int:
                 failures += 1
 
             # Handle unsupported architecture deletion
-            if (
-                args.delete_unsupported
-                and result.output
-                and ARCH_MISMATCH_TOKEN in result.output.lower()
-            ):
+            if args.delete_unsupported and result.arch_mismatch:
                 logger.warning("Deleting unsupported plugin bundle: %s", result.plugin)
                 try:
                     shutil.rmtree(result.plugin)
@@ -254,5 +433,10 @@ def main() -> int:
     return 0
 
 
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run a scan; ``argv`` defaults to ``sys.argv[1:]`` so callers can drive it as a library."""
+    return asyncio.run(main_async(argv))
+
+
 if __name__ == "__main__":
     raise SystemExit(main())